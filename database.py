@@ -5,12 +5,26 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from cachetools import TTLCache
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, WriteConcern
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
 from datetime import datetime, timezone
+import asyncio
+import logging
 import os
+import itertools
+from collections.abc import Hashable
+from functools import lru_cache
+from weakref import WeakKeyDictionary
 from dotenv import load_dotenv
-from typing import Union, Dict, List
-from pydantic import BaseModel
+from typing import Union, Dict, List, Optional, Callable, get_args
+from pydantic import BaseModel, TypeAdapter
+
+import schemas
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables from .env file
 load_dotenv()
@@ -18,67 +32,354 @@ load_dotenv()
 _client = None
 db = None
 
-# Simple in-memory fallback store (used only if DB is not configured)
-_memory_store: Dict[str, List[dict]] = {}
+# Simple in-memory fallback store (used only if DB is not configured),
+# bucketed by user_id so per-user lookups don't scan the whole collection.
+# _memory_rows keeps the same docs in insertion order for every other filter.
+_memory_store: Dict[str, Dict[Optional[str], List[dict]]] = {}
+_memory_rows: Dict[str, List[dict]] = {}
+_memory_ids = itertools.count(1)
+
+
+def _is_flat(annotation) -> bool:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return False
+    return all(_is_flat(arg) for arg in get_args(annotation))
+
+
+# Every collection model in schemas.py, so inserts can dispatch on type() without an ABC isinstance check.
+# Models without nested BaseModel fields can be copied straight from __dict__ instead of model_dump().
+_MODEL_TYPES = {
+    obj for obj in vars(schemas).values()
+    if isinstance(obj, type) and issubclass(obj, BaseModel) and obj.__module__ == schemas.__name__
+}
+_FLAT_MODELS = {
+    cls for cls in _MODEL_TYPES
+    if all(_is_flat(f.annotation) for f in cls.model_fields.values())
+}
+# One TypeAdapter serializer per nested model class, built on first use
+_DUMPERS: "WeakKeyDictionary[type, Callable]" = WeakKeyDictionary()
+
+# Short-lived cache of get_documents results: (collection, filter items) -> {(limit, sort, projection): docs}.
+# Entries for a user's {"user_id": ...} filter are dropped as soon as that user writes to the collection;
+# any other filter just ages out. Lookups and updates never await, so no lock is needed on the event loop.
+_query_cache: TTLCache = TTLCache(maxsize=10_000, ttl=10)
+# Cache keys that recently took an unacknowledged (w=0) write. The server may not have applied it yet,
+# so reads for these keys bypass the cache rather than storing a result that could miss the new doc.
+_unacked_keys: TTLCache = TTLCache(maxsize=10_000, ttl=10)
+# Bumped on every invalidation of a key. A read only stores its result if the generation it saw before
+# querying is unchanged, so a find that raced a write can't put the pre-write list back in the cache.
+# The TTL comfortably outlives any query (socketTimeoutMS is 10s), so entries never expire mid-read.
+_cache_generations: TTLCache = TTLCache(maxsize=100_000, ttl=60)
+_generation_ids = itertools.count(1)
+
+# Collection names for the /test status page, which may be polled as a health check
+_collections_cache: TTLCache = TTLCache(maxsize=1, ttl=30)
+
+# Write-behind queue for enqueue_document: flushed every _BATCH_MAX_DELAY seconds or _BATCH_MAX_DOCS docs
+_BATCH_MAX_DOCS = 500
+_BATCH_MAX_DELAY = 0.02
+# Cap on queued documents; once full, callers write synchronously so a stalled Mongo pushes back
+_QUEUE_MAX_DOCS = 10 * _BATCH_MAX_DOCS
+_write_queue: Optional[asyncio.Queue] = None
+_writer_task: Optional[asyncio.Task] = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    # One pooled client per process; each uvicorn worker builds its own on import.
+    # Motor keeps the calls non-blocking so all in-flight requests share this pool from one event loop.
+    _client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=int(os.getenv("MONGO_MAX_POOL", "50")),
+        minPoolSize=int(os.getenv("MONGO_MIN_POOL", "5")),
+        maxIdleTimeMS=60000,
+        serverSelectionTimeoutMS=3000,
+        socketTimeoutMS=10000,
+        connectTimeoutMS=5000,
+        retryWrites=True,
+        compressors=os.getenv("MONGO_COMPRESSORS", "zstd,snappy"),
+    )
     db = _client[database_name]
 
+
+async def ping():
+    """Warm up the connection pool so the first request doesn't pay the handshake.
+    Returns the configured pool options, or None when MongoDB is not configured.
+    """
+    if _client is None:
+        return None
+    await _client.admin.command("ping")
+    pool = _client.delegate.options.pool_options
+    return {"max_pool_size": pool.max_pool_size, "min_pool_size": pool.min_pool_size}
+
+
+async def ensure_indexes(collection_names: List[str]):
+    """Create the {user_id, created_at desc} index that per-user "recent" queries rely on."""
+    if db is None:
+        return
+    await asyncio.gather(*(
+        _coll(collection_name).create_index([("user_id", 1), ("created_at", -1)])
+        for collection_name in collection_names
+    ))
+
+
+async def list_collections() -> List[str]:
+    """Collection names in the configured database, cached for 30s."""
+    names = _collections_cache.get(database_name)
+    if names is None:
+        names = _collections_cache[database_name] = await db.list_collection_names()
+    return names
+
+
+def close():
+    """Close the MongoDB client and release pooled sockets."""
+    if _client is not None:
+        _client.close()
+
 # Helper functions for common database operations
 
-def _now():
-    return datetime.now(timezone.utc)
+@lru_cache(maxsize=32)
+def _coll(collection_name: str, durable: bool = True):
+    # db is bound once at import, so cached Collection objects never go stale
+    collection = db[collection_name]
+    if not durable:
+        collection = collection.with_options(write_concern=WriteConcern(w=0))
+    return collection
 
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
-    """Insert a single document with timestamp.
-    If MongoDB is not configured, gracefully fall back to in-memory store so the app remains usable.
-    """
+
+def _cache_key(collection_name: str, filter_dict: dict):
+    try:
+        key = (collection_name, frozenset(filter_dict.items()))
+        hash(key)
+    except TypeError:
+        # Operator filters like {"$in": [...]} are unhashable; just don't cache them
+        return None
+    return key
+
+
+def _invalidate_cached(collection_name: str, data_dict: dict, acknowledged: bool = True):
+    user_id = data_dict.get('user_id')
+    if user_id is None:
+        return
+    key = _cache_key(collection_name, {'user_id': user_id})
+    if key is None:
+        return
+    _query_cache.pop(key, None)
+    _cache_generations[key] = next(_generation_ids)
+    if not acknowledged:
+        _unacked_keys[key] = True
+
+
+def _prepare_document(data: Union[BaseModel, dict]) -> dict:
     # Convert Pydantic model to dict if needed
-    if isinstance(data, BaseModel):
-        data_dict = data.model_dump()
+    data_type = type(data)
+    if data_type is dict:
+        data_dict = data.copy()
+    elif data_type in _FLAT_MODELS:
+        data_dict = data.__dict__.copy()
+    elif data_type in _MODEL_TYPES or isinstance(data, BaseModel):
+        dump = _DUMPERS.get(data_type)
+        if dump is None:
+            dump = _DUMPERS[data_type] = TypeAdapter(data_type).dump_python
+        data_dict = dump(data)
     else:
         data_dict = dict(data)
 
-    data_dict['created_at'] = _now()
-    data_dict['updated_at'] = _now()
+    data_dict['created_at'] = data_dict['updated_at'] = datetime.now(timezone.utc)
+    return data_dict
+
+
+async def create_document(collection_name: str, data: Union[BaseModel, dict], durable: bool = True):
+    """Insert a single document with timestamp.
+    The id is generated client-side. With durable=False the insert is sent unacknowledged (w=0),
+    which suits log-like records where losing a write is acceptable.
+    If MongoDB is not configured, gracefully fall back to in-memory store so the app remains usable.
+    """
+    data_dict = _prepare_document(data)
 
     if db is None:
         # Fallback: store in-memory
-        coll = _memory_store.setdefault(collection_name, [])
-        # create a pseudo id
-        pseudo_id = f"demo-{collection_name}-{int(datetime.now().timestamp()*1000)}-{len(coll)+1}"
+        # create a pseudo id; the store only lives as long as the process, so a counter is unique enough
+        pseudo_id = f"demo-{collection_name}-{next(_memory_ids)}"
         data_dict['_id'] = pseudo_id
-        coll.append(data_dict)
+        _memory_store.setdefault(collection_name, {}).setdefault(data_dict.get('user_id'), []).append(data_dict)
+        _memory_rows.setdefault(collection_name, []).append(data_dict)
         return str(pseudo_id)
 
-    result = db[collection_name].insert_one(data_dict)
-    return str(result.inserted_id)
+    data_dict['_id'] = ObjectId()
+    await _coll(collection_name, durable).insert_one(data_dict)
+    _invalidate_cached(collection_name, data_dict, acknowledged=durable)
+    return str(data_dict['_id'])
+
+
+async def enqueue_document(collection_name: str, data: Union[BaseModel, dict]):
+    """Queue a document for a batched insert and return its id without waiting for the write.
+    Use create_document instead when the caller needs to read the document back right away.
+    Falls back to create_document when MongoDB or the batch writer is not running, or the queue is full.
+    """
+    if db is None or _write_queue is None:
+        return await create_document(collection_name, data)
+
+    data_dict = _prepare_document(data)
+    data_dict['_id'] = ObjectId()
+    try:
+        _write_queue.put_nowait((collection_name, data_dict))
+    except asyncio.QueueFull:
+        return await create_document(collection_name, data)
+    return str(data_dict['_id'])
+
+
+async def _bulk_insert(collection_name: str, docs: List[dict]) -> List[dict]:
+    # Returns the docs that did not make it in. Ids are generated client-side, so a duplicate _id
+    # means the doc already landed on an earlier attempt.
+    try:
+        await _coll(collection_name).bulk_write([InsertOne(doc) for doc in docs], ordered=False)
+    except BulkWriteError as e:
+        return [
+            docs[err['index']] for err in e.details.get('writeErrors', [])
+            if not (err.get('code') == 11000 and set(err.get('keyPattern', {})) == {'_id'})
+        ]
+    except Exception as e:
+        logger.warning("Batched insert into %s failed: %s", collection_name, str(e)[:200])
+        return docs
+    return []
+
 
+async def _flush_collection(collection_name: str, docs: List[dict]):
+    failed = await _bulk_insert(collection_name, docs)
+    if failed:
+        # These ids were already handed to clients; give a transient failure (e.g. stepdown) one more try
+        failed = await _bulk_insert(collection_name, failed)
+    if failed:
+        logger.error(
+            "Batched insert into %s lost %d of %d docs: %s",
+            collection_name, len(failed), len(docs), [str(doc['_id']) for doc in failed],
+        )
+    for doc in docs:
+        _invalidate_cached(collection_name, doc)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection.
+
+async def _flush_batch(batch: List[tuple]):
+    docs_by_collection: Dict[str, List[dict]] = {}
+    for collection_name, data_dict in batch:
+        docs_by_collection.setdefault(collection_name, []).append(data_dict)
+    # One bulk_write per collection, all in flight together
+    await asyncio.gather(*(
+        _flush_collection(collection_name, docs) for collection_name, docs in docs_by_collection.items()
+    ))
+
+
+async def _batch_writer(queue: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        batch = [item]
+        stopping = False
+        deadline = loop.time() + _BATCH_MAX_DELAY
+        while len(batch) < _BATCH_MAX_DOCS:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        await _flush_batch(batch)
+        if stopping:
+            return
+
+
+def start_batch_writer():
+    """Start the background task behind enqueue_document. Must be called from a running event loop."""
+    global _write_queue, _writer_task
+    if db is None or _writer_task is not None:
+        return
+    _write_queue = asyncio.Queue(maxsize=_QUEUE_MAX_DOCS)
+    _writer_task = asyncio.create_task(_batch_writer(_write_queue))
+
+
+async def stop_batch_writer():
+    """Flush pending queued documents and stop the background writer."""
+    global _write_queue, _writer_task
+    if _writer_task is None:
+        return
+    queue, task = _write_queue, _writer_task
+    # New writes go straight to create_document from here on
+    _write_queue = None
+    _writer_task = None
+    await queue.put(None)
+    await task
+
+
+def _project(doc: dict, projection: dict) -> dict:
+    # Mirror Mongo projection semantics: inclusion unless every non-_id field is excluded
+    if any(v for k, v in projection.items() if k != '_id'):
+        keep = {k for k, v in projection.items() if v}
+        if projection.get('_id', 1):
+            keep.add('_id')
+        return {k: v for k, v in doc.items() if k in keep}
+    return {k: v for k, v in doc.items() if projection.get(k, 1)}
+
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None,
+                        sort: List[tuple] = None, projection: dict = None):
+    """Get documents from collection, optionally sorted (e.g. [("created_at", -1)]) and projected.
+    The returned list is the caller's own, but the documents in it may be shared with the query cache
+    (or the in-memory store): treat them as read-only and copy before modifying.
     If MongoDB is not configured, read from in-memory fallback so UI can render.
     """
     filter_dict = filter_dict or {}
 
     if db is None:
-        coll = _memory_store.get(collection_name, [])
-        # naive filter
-        def _matches(doc: dict) -> bool:
-            for k, v in filter_dict.items():
-                if doc.get(k) != v:
-                    return False
-            return True
-        results = [doc for doc in coll if _matches(doc)]
+        if filter_dict.keys() == {'user_id'} and isinstance(filter_dict['user_id'], Hashable):
+            results = list(_memory_store.get(collection_name, {}).get(filter_dict['user_id'], ()))
+        else:
+            # naive filter
+            def _matches(doc: dict) -> bool:
+                for k, v in filter_dict.items():
+                    if doc.get(k) != v:
+                        return False
+                return True
+            results = [doc for doc in _memory_rows.get(collection_name, ()) if _matches(doc)]
+        # stable sorts applied last key first give a multi-key sort
+        for field, direction in reversed(sort or []):
+            results.sort(key=lambda doc: doc.get(field), reverse=direction < 0)
         if limit:
             results = results[:limit]
+        if projection:
+            results = [_project(doc, projection) for doc in results]
         return results
 
-    cursor = db[collection_name].find(filter_dict)
+    key = _cache_key(collection_name, filter_dict)
+    if key is not None and key in _unacked_keys:
+        key = None
+    options = (limit, tuple(sort) if sort else None, tuple(sorted(projection.items())) if projection else None)
+    if key is not None:
+        cached = _query_cache.get(key, {}).get(options)
+        if cached is not None:
+            return list(cached)
+
+    generation = _cache_generations.get(key)
+    cursor = _coll(collection_name).find(filter_dict, projection)
+    if sort:
+        cursor = cursor.sort(sort)
     if limit:
         cursor = cursor.limit(limit)
-    return list(cursor)
+    results = await cursor.to_list(length=limit)
+
+    if key is not None and _cache_generations.get(key) == generation:
+        entry = _query_cache.get(key)
+        if entry is None:
+            entry = _query_cache[key] = {}
+        # A slower concurrent query may have come back with fewer docs; keep the fuller result
+        cached = entry.get(options)
+        if cached is None or len(results) >= len(cached):
+            entry[options] = list(results)
+    return results
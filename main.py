@@ -1,30 +1,88 @@
 import os
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import asyncio
+import logging
+import orjson
+from fastapi import FastAPI, UploadFile, File, HTTPException, Response
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional, Literal
 
-from database import db, create_document, get_documents
+import database
+from database import db, create_document, enqueue_document, get_documents
 from schemas import User, Profile, ChatMessage, Doubt, Flashcard, FlashcardItem, Quiz, QuizQuestion, StudyPlan, StudyTask, NoteSummary, SavedItem
 
-app = FastAPI(title="Study Buddy API")
+app = FastAPI(title="Study Buddy API", default_response_class=ORJSONResponse)
+logger = logging.getLogger("uvicorn.error")
+
+RECENT_FIRST = [("created_at", -1)]
+# Library listings only show headers for generated sets and never the raw note text
+HEADER_FIELDS = {"_id": 1, "topic": 1, "created_at": 1}
+WITHOUT_NOTE_TEXT = {"text": 0}
+
+# /library sections: response key -> (collection, limit, projection), all queried per user newest first.
+# Index creation at startup reads the collections from here too, so every listed collection is indexed.
+LIBRARY_SECTIONS = {
+    "recent_doubts": ("doubt", 10, None),
+    "flashcards": ("flashcard", 10, HEADER_FIELDS),
+    "quizzes": ("quiz", 10, HEADER_FIELDS),
+    "plans": ("studyplan", 5, None),
+    "summaries": ("notesummary", 10, WITHOUT_NOTE_TEXT),
+}
+LIBRARY_COLLECTIONS = [collection for collection, _, _ in LIBRARY_SECTIONS.values()]
+
+# Shared by every generated MCQ question; immutable so one tuple serves all of them
+MCQ_OPTIONS = ("A", "B", "C", "D")
+SUMMARY_BULLETS = ("Key point 1", "Key point 2", "Key point 3", "Key point 4", "Key point 5")
+SUMMARY_EXPLANATION = "Short explanation combining the key points in simple language."
+
+# Request bodies are read-only and reject unknown fields
+REQUEST_CONFIG = ConfigDict(extra="forbid", frozen=True)
+
+# CORS_ORIGINS is a comma-separated list of frontend origins; without it no cross-origin requests are allowed.
+# Preflights are cached by the browser for a day.
+CORS_ORIGINS = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "").split(",") if origin.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["authorization", "content-type"],
+    max_age=86400,
 )
 
 
+@app.on_event("startup")
+async def startup():
+    if not CORS_ORIGINS:
+        logger.warning("CORS_ORIGINS is not set; browsers on other origins will be refused")
+    try:
+        pool = await database.ping()
+        if pool is not None:
+            logger.info("MongoDB connected, pool: %s", pool)
+    except Exception as e:
+        logger.warning("MongoDB ping failed at startup: %s", str(e)[:100])
+    try:
+        await database.ensure_indexes(LIBRARY_COLLECTIONS)
+    except Exception as e:
+        logger.warning("Index creation failed at startup: %s", str(e)[:100])
+    database.start_batch_writer()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await database.stop_batch_writer()
+    database.close()
+
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Study Buddy Backend running"}
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -41,7 +99,7 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await database.list_collections()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -58,13 +116,15 @@ def test_database():
 
 # ---------- Auth & Profile (placeholder simple flows) ----------
 class LoginRequest(BaseModel):
+    model_config = REQUEST_CONFIG
+
     provider: Literal["email", "phone", "google"] = "email"
     identifier: str
     name: Optional[str] = None
 
 
 @app.post("/auth/login")
-def login(req: LoginRequest):
+async def login(req: LoginRequest):
     user = {
         "name": req.name or "Student",
         "email": req.identifier if req.provider == "email" else None,
@@ -72,11 +132,13 @@ def login(req: LoginRequest):
         "provider": req.provider,
         "preferred_language": "English",
     }
-    user_id = create_document("user", user)
+    user_id = await create_document("user", user)
     return {"user_id": user_id, "message": "Logged in"}
 
 
 class ProfileSetup(BaseModel):
+    model_config = REQUEST_CONFIG
+
     user_id: str
     grade: Optional[str] = None
     subjects: List[str] = []
@@ -86,7 +148,7 @@ class ProfileSetup(BaseModel):
 
 
 @app.post("/profile/setup")
-def setup_profile(data: ProfileSetup):
+async def setup_profile(data: ProfileSetup):
     profile = {
         "user_id": data.user_id,
         "grade": data.grade,
@@ -94,12 +156,14 @@ def setup_profile(data: ProfileSetup):
         "study_goal": data.study_goal,
         "daily_study_minutes": data.daily_study_minutes,
     }
-    pid = create_document("profile", profile)
+    pid = await create_document("profile", profile)
     return {"profile_id": pid}
 
 
 # ---------- AI-lite utility generators (rule-based for demo) ----------
 class ChatRequest(BaseModel):
+    model_config = REQUEST_CONFIG
+
     user_id: str
     message: str
     subject: Optional[str] = None
@@ -107,7 +171,7 @@ class ChatRequest(BaseModel):
 
 
 @app.post("/chat")
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest):
     # Very simple rule-based response for demo
     msg = req.message.strip()
     if req.action == "explain10":
@@ -119,35 +183,40 @@ def chat(req: ChatRequest):
             {"question": f"What is: {msg}?", "answer": "Definition in 1-2 lines"},
             {"question": f"Why is {msg} important?", "answer": "Key reason"},
         ]
-        fid = create_document("flashcard", {"user_id": req.user_id, "topic": msg, "items": items})
+        fid = await enqueue_document("flashcard", {"user_id": req.user_id, "topic": msg, "items": items})
         return {"type": "flashcards", "flashcard_id": fid, "items": items}
     elif req.action == "quiz":
         questions = [
             {"question": f"Explain {msg} in one line", "type": "short"},
-            {"question": f"Which is true about {msg}?", "type": "mcq", "options": ["A", "B", "C", "D"], "answer": "A"},
+            {"question": f"Which is true about {msg}?", "type": "mcq", "options": MCQ_OPTIONS, "answer": "A"},
         ]
-        qid = create_document("quiz", {"user_id": req.user_id, "topic": msg, "questions": questions})
+        qid = await enqueue_document("quiz", {"user_id": req.user_id, "topic": msg, "questions": questions})
         return {"type": "quiz", "quiz_id": qid, "questions": questions}
     else:
         answer = f"Answer for '{msg}': here's a clear explanation with steps where needed."
 
-    did = create_document("doubt", {"user_id": req.user_id, "source": "text", "prompt": msg, "answer": answer})
+    did = await create_document("doubt", {"user_id": req.user_id, "source": "text", "prompt": msg, "answer": answer}, durable=False)
     return {"type": "answer", "doubt_id": did, "answer": answer}
 
 
 # ---------- Photo Doubt (mock OCR) ----------
 @app.post("/photo-doubt")
-def photo_doubt(user_id: str, file: UploadFile = File(...)):
+async def photo_doubt(user_id: str, file: UploadFile = File(...)):
     filename = file.filename or "image.jpg"
+    # Mock OCR only needs the name; release the spooled upload now instead of at request teardown.
+    # Real OCR should stream chunks from `file` to the OCR driver rather than reading it whole.
+    await file.close()
     # Mock OCR result
     ocr_text = f"Extracted text from {filename}"
     answer = f"Solution based on OCR: {ocr_text}. If unclear, please retake a brighter photo."
-    did = create_document("doubt", {"user_id": user_id, "source": "image", "image_url": filename, "ocr_text": ocr_text, "answer": answer})
+    did = await create_document("doubt", {"user_id": user_id, "source": "image", "image_url": filename, "ocr_text": ocr_text, "answer": answer}, durable=False)
     return {"doubt_id": did, "ocr_text": ocr_text, "answer": answer}
 
 
 # ---------- Flashcards Generator ----------
 class FlashcardRequest(BaseModel):
+    model_config = REQUEST_CONFIG
+
     user_id: str
     subject: Optional[str] = None
     topic: Optional[str] = None
@@ -156,35 +225,39 @@ class FlashcardRequest(BaseModel):
 
 
 @app.post("/flashcards")
-def generate_flashcards(req: FlashcardRequest):
-    items = []
-    for i in range(max(1, min(req.count, 20))):
-        items.append({"question": f"Q{i+1} about {req.topic or 'topic'}", "answer": "Concise answer"})
-    fid = create_document("flashcard", {"user_id": req.user_id, "subject": req.subject, "topic": req.topic, "items": items})
+async def generate_flashcards(req: FlashcardRequest):
+    q_suffix = f" about {req.topic or 'topic'}"
+    items = [{"question": f"Q{i}{q_suffix}", "answer": "Concise answer"} for i in range(1, max(1, min(req.count, 20)) + 1)]
+    fid = await enqueue_document("flashcard", {"user_id": req.user_id, "subject": req.subject, "topic": req.topic, "items": items})
     return {"flashcard_id": fid, "items": items}
 
 
 # ---------- Quiz Generator ----------
 class QuizRequest(BaseModel):
+    model_config = REQUEST_CONFIG
+
     user_id: str
     topic: str
     count: Literal[5, 10] = 5
 
 
 @app.post("/quiz")
-def generate_quiz(req: QuizRequest):
-    questions: List[dict] = []
-    for i in range(req.count):
-        if i % 2 == 0:
-            questions.append({"question": f"MCQ on {req.topic} #{i+1}", "type": "mcq", "options": ["A", "B", "C", "D"], "answer": "A"})
-        else:
-            questions.append({"question": f"Short answer on {req.topic} #{i+1}", "type": "short"})
-    qid = create_document("quiz", {"user_id": req.user_id, "topic": req.topic, "questions": questions})
+async def generate_quiz(req: QuizRequest):
+    mcq_prefix = f"MCQ on {req.topic} #"
+    short_prefix = f"Short answer on {req.topic} #"
+    questions: List[dict] = [
+        {"question": mcq_prefix + str(i), "type": "mcq", "options": MCQ_OPTIONS, "answer": "A"} if i % 2 else
+        {"question": short_prefix + str(i), "type": "short"}
+        for i in range(1, req.count + 1)
+    ]
+    qid = await enqueue_document("quiz", {"user_id": req.user_id, "topic": req.topic, "questions": questions})
     return {"quiz_id": qid, "questions": questions}
 
 
 # ---------- Study Planner ----------
 class PlanRequest(BaseModel):
+    model_config = REQUEST_CONFIG
+
     user_id: str
     exam_date: str
     daily_minutes: int
@@ -192,46 +265,44 @@ class PlanRequest(BaseModel):
 
 
 @app.post("/planner")
-def create_plan(req: PlanRequest):
+async def create_plan(req: PlanRequest):
     # naive daily tasks distribution
-    tasks: List[dict] = []
     per_day = max(1, req.daily_minutes // max(1, len(req.subjects)))
-    for idx, subject in enumerate(req.subjects):
-        tasks.append({"date": f"D+{idx+1}", "subject": subject, "topic": f"Core concepts {idx+1}", "minutes": per_day})
-    pid = create_document("studyplan", {"user_id": req.user_id, "exam_date": req.exam_date, "daily_minutes": req.daily_minutes, "subjects": req.subjects, "tasks": tasks})
+    tasks: List[dict] = [
+        {"date": f"D+{n}", "subject": subject, "topic": f"Core concepts {n}", "minutes": per_day}
+        for n, subject in enumerate(req.subjects, 1)
+    ]
+    pid = await create_document("studyplan", {"user_id": req.user_id, "exam_date": req.exam_date, "daily_minutes": req.daily_minutes, "subjects": req.subjects, "tasks": tasks})
     return {"plan_id": pid, "tasks": tasks}
 
 
 # ---------- Notes Summary ----------
 class SummaryRequest(BaseModel):
+    model_config = REQUEST_CONFIG
+
     user_id: str
     subject: Optional[str] = None
     text: str
 
 
 @app.post("/summary")
-def summarize(req: SummaryRequest):
-    bullets = ["Key point 1", "Key point 2", "Key point 3", "Key point 4", "Key point 5"]
-    explanation = "Short explanation combining the key points in simple language."
-    sid = create_document("notesummary", {"user_id": req.user_id, "subject": req.subject, "text": req.text, "bullets": bullets, "explanation": explanation})
-    return {"summary_id": sid, "bullets": bullets, "explanation": explanation}
+async def summarize(req: SummaryRequest):
+    sid = await create_document("notesummary", {"user_id": req.user_id, "subject": req.subject, "text": req.text, "bullets": SUMMARY_BULLETS, "explanation": SUMMARY_EXPLANATION})
+    return {"summary_id": sid, "bullets": SUMMARY_BULLETS, "explanation": SUMMARY_EXPLANATION}
 
 
 # ---------- Saved Library (list recent) ----------
 @app.get("/library/{user_id}")
-def library(user_id: str):
-    recent_doubts = get_documents("doubt", {"user_id": user_id}, limit=10)
-    recent_flash = get_documents("flashcard", {"user_id": user_id}, limit=10)
-    recent_quiz = get_documents("quiz", {"user_id": user_id}, limit=10)
-    recent_plans = get_documents("studyplan", {"user_id": user_id}, limit=5)
-    recent_summaries = get_documents("notesummary", {"user_id": user_id}, limit=10)
-    return {
-        "recent_doubts": recent_doubts,
-        "flashcards": recent_flash,
-        "quizzes": recent_quiz,
-        "plans": recent_plans,
-        "summaries": recent_summaries,
-    }
+async def library(user_id: str):
+    # Independent queries: run them concurrently so the endpoint pays ~1 RTT instead of 5
+    sections = await asyncio.gather(*(
+        get_documents(collection, {"user_id": user_id}, limit=limit, sort=RECENT_FIRST, projection=projection)
+        for collection, limit, projection in LIBRARY_SECTIONS.values()
+    ))
+    payload = dict(zip(LIBRARY_SECTIONS, sections))
+    # Serialize raw Mongo docs directly: ObjectId falls back to str, naive datetimes are UTC
+    content = orjson.dumps(payload, default=str, option=orjson.OPT_NAIVE_UTC)
+    return Response(content=content, media_type="application/json")
 
 
 if __name__ == "__main__":
@@ -15,5 +15,8 @@ mkdir -p logs
 echo "Installing dependencies..."
 pip install -r requirements.txt
 echo "Starting FastAPI server..."
+if [ -z "$CORS_ORIGINS" ]; then
+  echo "Warning: CORS_ORIGINS is not set; cross-origin requests will be refused (e.g. CORS_ORIGINS=https://app.example.com)"
+fi
 nohup uvicorn main:app --host 0.0.0.0 --port 8000 --reload > logs/server.log 2>&1 
 echo "Server started in background"
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+import database
+
+
+class StubCursor:
+    def __init__(self, docs, gate):
+        # Snapshot at find() time, like a query the server has already executed
+        self.docs = list(docs)
+        self.gate = gate
+
+    def sort(self, sort):
+        return self
+
+    def limit(self, limit):
+        return self
+
+    async def to_list(self, length=None):
+        await self.gate.wait()
+        return self.docs[:length]
+
+
+class StubCollection:
+    """Minimal stand-in for a Motor collection backed by a list."""
+
+    def __init__(self):
+        self.docs = []
+        self.bulk_failures = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    def find(self, filter_dict, projection=None):
+        return StubCursor(self.docs, self.gate)
+
+    async def insert_one(self, doc):
+        self.docs.append(doc)
+
+    async def bulk_write(self, ops, ordered=True):
+        if self.bulk_failures:
+            raise self.bulk_failures.pop(0)
+        self.docs.extend(op._doc for op in ops)
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    stub = StubCollection()
+    monkeypatch.setattr(database, "db", object())
+    monkeypatch.setattr(database, "_coll", lambda name, durable=True: stub)
+    database._query_cache.clear()
+    database._unacked_keys.clear()
+    database._cache_generations.clear()
+    return stub
+
+
+def _batch(*ids):
+    return [{"_id": i, "user_id": "u"} for i in ids]
+
+
+def test_flush_retries_failed_docs_once(collection):
+    collection.bulk_failures = [AutoReconnect("primary stepped down")]
+
+    asyncio.run(database._flush_collection("quiz", _batch(1, 2)))
+
+    assert [doc["_id"] for doc in collection.docs] == [1, 2]
+
+
+def test_flush_treats_duplicate_id_on_retry_as_landed(collection):
+    docs = _batch(1, 2)
+    collection.bulk_failures = [
+        BulkWriteError({"writeErrors": [{"index": 1, "code": 91, "errmsg": "shutdown"}]}),
+        BulkWriteError({"writeErrors": [{"index": 0, "code": 11000, "keyPattern": {"_id": 1}}]}),
+    ]
+
+    failed = asyncio.run(database._bulk_insert("quiz", docs))
+    assert failed == [docs[1]]
+    assert asyncio.run(database._bulk_insert("quiz", failed)) == []
+
+
+def test_read_racing_a_write_does_not_cache_stale_result(collection):
+    async def scenario():
+        await database.create_document("doubt", {"user_id": "u"})
+        collection.gate.clear()
+        slow_read = asyncio.create_task(database.get_documents("doubt", {"user_id": "u"}, limit=10))
+        await asyncio.sleep(0)
+        await database.create_document("doubt", {"user_id": "u"})
+        collection.gate.set()
+        assert len(await slow_read) == 1
+        return await database.get_documents("doubt", {"user_id": "u"}, limit=10)
+
+    assert len(asyncio.run(scenario())) == 2
+
+
+def test_cached_results_are_returned_as_copies(collection):
+    async def scenario():
+        await database.create_document("doubt", {"user_id": "u"})
+        first = await database.get_documents("doubt", {"user_id": "u"})
+        first.clear()
+        return await database.get_documents("doubt", {"user_id": "u"})
+
+    assert len(asyncio.run(scenario())) == 1
+
+
+def test_fallback_scan_keeps_insertion_order(monkeypatch):
+    monkeypatch.setattr(database, "db", None)
+    monkeypatch.setattr(database, "_memory_store", {})
+    monkeypatch.setattr(database, "_memory_rows", {})
+
+    async def scenario():
+        for user_id in ("a", "b", "a"):
+            await database.create_document("quiz", {"user_id": user_id, "topic": "t"})
+        return await database.get_documents("quiz", {"topic": "t"}, limit=2)
+
+    assert [doc["user_id"] for doc in asyncio.run(scenario())] == ["a", "b"]